@@ -1,17 +1,82 @@
-from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from datetime import datetime
-import json
-from jinja2 import Environment, FileSystemLoader
-import pandas as pd
+from functools import lru_cache, partial
+import gzip
+import hashlib
+import orjson
+import os
+import sys
 import argparse
-from http.server import HTTPServer, SimpleHTTPRequestHandler
+from http import HTTPStatus
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import urlsplit
 
 
 # Глобальная константа - она никогда не меняется
 FOUNDATION_YEAR = 1920
 
-
-def get_year_word(age):
+# Возраст винодельни меняется только в Новый год, поэтому считается
+# один раз при запуске программы
+WINERY_AGE = datetime.now().year - FOUNDATION_YEAR
+
+# Поля вина, которые попадают в шаблон и JSON
+WINE_FIELDS = ['Название', 'Сорт', 'Цена', 'Картинка']
+
+# Колонки Excel, которые нужны программе; остальные не читаются
+EXCEL_COLUMNS = ['Категория', *WINE_FIELDS]
+
+# Версия формата CSV-кэша: меняется вместе с колонками и параметрами чтения
+CSV_CACHE_VERSION = 1
+
+# Текстовые колонки: и из Excel, и из CSV-кэша они читаются как строки
+TEXT_COLUMNS_DTYPES = {
+    'Категория': str,
+    'Название': str,
+    'Сорт': str,
+    'Картинка': str
+}
+
+# Разметка карточки вина. Карточки собираются через format_map,
+# а не циклом Jinja: их много, а разметка простая. Вызывается из
+# template.html через render_wine_cards. Значения не экранируются —
+# как и в шаблоне, где autoescape выключен
+WINE_CARD_HTML = """
+              <div class="col-lg-4 mb-5 col-md-6">
+                <div class="wine_v_1 text-center pb-4 pt-5">
+                  <img src="images/{Картинка}" alt="{Название}" class="img-fluid">
+{promo_badge}
+                  <div>
+                    <h3 class="heading mt-3 mb-3 text-dark">{Название}</h3>
+                    <p>
+{grape}
+                      <span class="price">{Цена} ₽</span>
+                    </p>
+                  </div>
+                </div>
+              </div>"""
+
+# Значок "Выгодное предложение" - показываем только если есть акция
+PROMO_BADGE_HTML = (
+    '                  <img src="assets/profitable.png" '
+    'class="profitable-badge" alt="Выгодное предложение">'
+)
+
+# Сорт показываем только если он есть
+GRAPE_HTML = '                      Сорт винограда — {}<br/>'
+
+# Шаблон страницы магазина
+TEMPLATE_PATH = 'template.html'
+
+# Скомпилированные шаблоны сохраняются между запусками программы
+JINJA_CACHE_DIR = Path('.jinja_cache')
+
+# Шаблоны, заранее скомпилированные в Python-модули
+COMPILED_TEMPLATES_DIR = Path('compiled_templates')
+
+
+def _compute_year_word(age):
     """
     Возвращает правильное склонение слова 'год' для настоящего времени.
     """
@@ -27,102 +92,382 @@ def get_year_word(age):
         return 'лет'
 
 
+# Склонение зависит только от двух последних цифр возраста
+YEAR_WORDS = tuple(_compute_year_word(age) for age in range(100))
+
+
+def get_year_word(age):
+    """
+    Возвращает правильное склонение слова 'год' по готовой таблице.
+    """
+    return YEAR_WORDS[age % 100]
+
+
+def render_wine_cards(wines):
+    """
+    Собирает HTML карточек вин одной категории.
+    """
+    return ''.join(
+        WINE_CARD_HTML.format_map({
+            **wine,
+            'promo_badge': PROMO_BADGE_HTML if wine['Акция'] else '',
+            'grape': GRAPE_HTML.format(wine['Сорт']) if wine['Сорт'] else ''
+        })
+        for wine in wines
+    )
+
+
 def find_cheapest_wine(wines_data):
     """
     Находит самое дешёвое вино среди всех.
     """
-    valid_wines = [
-        wine for wine in wines_data
-        if pd.notna(wine.get('Цена')) and wine.get('Цена') > 0
-    ]
+    prices = wines_data['Цена']
+    is_valid_price = prices.gt(0)
 
-    if not valid_wines:
+    if not is_valid_price.any():
         return None
 
-    return min(valid_wines, key=lambda wine: wine['Цена'])
+    return wines_data.loc[prices.where(is_valid_price).idxmin()].to_dict()
 
 
-def process_wine_data(wine_data, cheapest_wine):
+def process_wine_data(wines_data, cheapest_name, cheapest_price):
     """
-    Обрабатывает данные одного вина и определяет,
-    является ли оно самым дешёвым.
+    Очищает данные о винах от пропусков и отмечает,
+    какое из них самое дешёвое.
     """
-    is_cheapest = (
-        wine_data.get('Название') == cheapest_wine.get('Название') and
-        wine_data.get('Цена') == cheapest_wine.get('Цена')
+    wines = wines_data.reindex(columns=WINE_FIELDS).fillna(
+        {'Название': '', 'Сорт': '', 'Картинка': ''}
     )
 
-    title = wine_data.get('Название', '')
-    grape = wine_data.get('Сорт', '')
-    price = wine_data.get('Цена')
-    image = wine_data.get('Картинка', '')
+    prices = wines['Цена']
+    wines['Цена'] = prices.astype(object).where(prices.notna(), None)
+    wines['Акция'] = (
+        (wines['Название'] == cheapest_name) &
+        (wines['Цена'] == cheapest_price)
+    )
 
-    return {
-        'Название': title if pd.notna(title) else '',
-        'Сорт': grape if pd.notna(grape) else '',
-        'Цена': price if pd.notna(price) else None,
-        'Картинка': image if pd.notna(image) else '',
-        'Акция': is_cheapest
-    }
+    return wines
+
+
+def is_cache_fresh(cache_path, source_path):
+    """
+    Проверяет, что кэш существует и не старше исходного файла.
+    """
+    return (
+        cache_path.exists() and
+        cache_path.stat().st_mtime >= source_path.stat().st_mtime
+    )
+
+
+@contextmanager
+def replace_on_success(path):
+    """
+    Отдаёт путь временного файла рядом с path и переносит его на место
+    path, только если запись прошла без ошибок. Оборванная запись
+    не оставляет после себя частично записанный файл.
+    """
+    path = Path(path)
+    temp_path = path.with_name(f'{path.name}.{os.getpid()}.tmp')
+    try:
+        yield temp_path
+        os.replace(temp_path, path)
+    finally:
+        temp_path.unlink(missing_ok=True)
+
+
+def cast_text_columns(wines_data):
+    """
+    Приводит текстовые колонки к строкам, сохраняя пропуски,
+    как это делает read_csv с dtype=TEXT_COLUMNS_DTYPES.
+    """
+    for column in TEXT_COLUMNS_DTYPES.keys() & set(wines_data.columns):
+        values = wines_data[column]
+        wines_data[column] = values.astype(str).where(values.notna())
+    return wines_data
 
 
 def load_wine_data_from_excel(file_path):
     """
     Загружает данные о винах из Excel файла.
+
+    Прочитанная таблица кэшируется в CSV рядом с Excel файлом,
+    и пока Excel не изменился, данные читаются из CSV.
     """
-    excel_data = pd.read_excel(
-        file_path,
+    import pandas as pd
+
+    excel_path = Path(file_path)
+    csv_path = excel_path.with_name(
+        f'{excel_path.name}.v{CSV_CACHE_VERSION}.cache.csv'
+    )
+
+    if is_cache_fresh(csv_path, excel_path):
+        return pd.read_csv(
+            csv_path,
+            dtype=TEXT_COLUMNS_DTYPES,
+            na_values='',
+            keep_default_na=False
+        )
+
+    excel_data = cast_text_columns(pd.read_excel(
+        excel_path,
+        engine='calamine',
+        usecols=lambda column: column in EXCEL_COLUMNS,
         na_values='',
         keep_default_na=False
-    )
-    return excel_data.to_dict(orient='records')
+    ))
+    try:
+        with replace_on_success(csv_path) as temp_csv_path:
+            excel_data.to_csv(temp_csv_path, index=False)
+    except OSError:
+        # Каталог с Excel может быть только для чтения — работаем без кэша
+        pass
+    return excel_data
 
 
 def group_wines_by_category(wines_data, cheapest_wine):
     """
     Группирует вина по категориям.
     """
-    grouped_wines = defaultdict(list)
-
-    for wine in wines_data:
-        category = wine.get('Категория', '')
-        if pd.notna(category):
-            category = category.strip()
-        else:
-            category = ''
-
-        if not category:
-            continue
+    categories = wines_data['Категория'].fillna('').astype(str).str.strip()
+    has_category = categories != ''
 
-        processed_wine = process_wine_data(wine, cheapest_wine)
-        grouped_wines[category].append(processed_wine)
+    wines = process_wine_data(
+        wines_data[has_category],
+        cheapest_wine.get('Название'),
+        cheapest_wine.get('Цена')
+    )
+    grouped_wines = wines.groupby(categories[has_category], sort=False)
 
-    return grouped_wines
+    return {
+        category: category_wines.to_dict(orient='records')
+        for category, category_wines in grouped_wines
+    }
 
 
 def save_data_to_json(data, file_path):
     """
     Сохраняет данные в JSON файл.
     """
-    with open(file_path, 'w', encoding='utf-8') as file:
-        json.dump(data, file, ensure_ascii=False, indent=2)
+    with open(file_path, 'wb') as file:
+        file.write(orjson.dumps(data, option=orjson.OPT_INDENT_2))
 
 
-def generate_html_page(wines_data, age, output_path='index.html'):
+@lru_cache(maxsize=None)
+def get_jinja_env():
     """
-    Генерирует HTML страницу на основе данных о винах.
+    Создаёт окружение Jinja2 один раз: шаблон не меняется во время работы.
     """
-    env = Environment(loader=FileSystemLoader('.'))
-    template = env.get_template('template.html')
+    from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader
+
+    JINJA_CACHE_DIR.mkdir(exist_ok=True)
+    env = Environment(
+        loader=FileSystemLoader('.'),
+        bytecode_cache=FileSystemBytecodeCache(directory=str(JINJA_CACHE_DIR)),
+        auto_reload=False,
+        cache_size=400
+    )
+    env.globals['get_year_word'] = get_year_word
+    env.globals['render_wine_cards'] = render_wine_cards
+    return env
+
 
-    rendered_page = template.render(
-        age=age,
-        get_year_word=get_year_word,
-        wines=wines_data
+def get_compiled_template_paths(template_path):
+    """
+    Возвращает пути к скомпилированному модулю шаблона
+    и к файлу с контрольной суммой исходника, из которого он собран.
+    """
+    from jinja2 import ModuleLoader
+
+    module_path = (
+        COMPILED_TEMPLATES_DIR /
+        ModuleLoader.get_module_filename(template_path)
+    )
+    return module_path, module_path.with_suffix('.sha256')
+
+
+def get_template_checksum(template_path):
+    """
+    Считает контрольную сумму исходного файла шаблона вместе с версией
+    Jinja2: модуль, собранный другой версией, тоже считается устаревшим.
+    """
+    import jinja2
+
+    source_checksum = hashlib.sha256(
+        Path(template_path).read_bytes()
+    ).hexdigest()
+    return f'jinja2 {jinja2.__version__} {source_checksum}'
+
+
+def is_compiled_template_fresh(template_path):
+    """
+    Проверяет, что скомпилированный модуль собран
+    из текущей версии шаблона.
+    """
+    module_path, checksum_path = get_compiled_template_paths(template_path)
+    if not module_path.exists() or not checksum_path.exists():
+        return False
+
+    return (
+        checksum_path.read_text(encoding='utf-8') ==
+        get_template_checksum(template_path)
+    )
+
+
+@lru_cache(maxsize=None)
+def _get_template(template_path):
+    """
+    Возвращает скомпилированный шаблон, разбирая файл только один раз.
+    Заранее скомпилированный модуль используется, только если он
+    собран из текущей версии шаблона.
+    """
+    from jinja2 import ModuleLoader
+
+    env = get_jinja_env()
+    module_path, _ = get_compiled_template_paths(template_path)
+
+    if is_compiled_template_fresh(template_path):
+        return ModuleLoader(str(COMPILED_TEMPLATES_DIR)).load(
+            env,
+            template_path,
+            env.make_globals(None)
+        )
+
+    if module_path.exists():
+        print(
+            f"Скомпилированный шаблон {module_path} устарел, "
+            f"используется {template_path}",
+            file=sys.stderr
+        )
+    return env.get_template(template_path)
+
+
+def compile_template(template_path=TEMPLATE_PATH):
+    """
+    Компилирует шаблон в Python-модуль, который затем
+    загружается вместо разбора исходного файла.
+    """
+    from jinja2 import FileSystemLoader
+
+    env = get_jinja_env()
+    source, filename, _ = FileSystemLoader('.').get_source(env, template_path)
+    code = env.compile(
+        source,
+        template_path,
+        filename,
+        raw=True,
+        defer_init=True
+    )
+
+    COMPILED_TEMPLATES_DIR.mkdir(exist_ok=True)
+    module_path, checksum_path = get_compiled_template_paths(template_path)
+    module_path.write_text(code, encoding='utf-8')
+    checksum_path.write_text(
+        get_template_checksum(template_path),
+        encoding='utf-8'
     )
+    return module_path
+
+
+def generate_html_page(wines_data, age, output_path='index.html',
+                       template_path=TEMPLATE_PATH):
+    """
+    Генерирует HTML страницу на основе данных о винах.
+    Страница пишется в файл по частям, не собираясь целиком в памяти,
+    и заменяет прежнюю только после успешного рендера.
+    """
+    template = _get_template(template_path)
+
+    with replace_on_success(output_path) as temp_output_path:
+        template.stream(
+            age=age,
+            wines=wines_data
+        ).dump(str(temp_output_path), encoding='utf-8')
+
 
-    with open(output_path, 'w', encoding='utf-8') as file:
-        file.write(rendered_page)
+def is_gzip_accepted(accept_encoding):
+    """
+    Проверяет, разрешает ли заголовок Accept-Encoding сжатие gzip,
+    с учётом весов вида 'gzip;q=0'.
+    """
+    qualities = {}
+    for coding in accept_encoding.split(','):
+        name, *params = coding.split(';')
+        quality = 1.0
+        for param in params:
+            key, _, value = param.partition('=')
+            if key.strip().lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities[name.strip().lower()] = quality
+
+    return qualities.get('gzip', qualities.get('*', 0.0)) > 0
+
+
+class CachedPageHandler(SimpleHTTPRequestHandler):
+    """
+    Отдаёт сгенерированную страницу из памяти,
+    остальные файлы сайта — с диска.
+    """
+
+    def __init__(self, *args, page_urls, page, gzipped_page, **kwargs):
+        self.page_urls = page_urls
+        self.page = page
+        self.gzipped_page = gzipped_page
+        super().__init__(*args, **kwargs)
+
+    def do_GET(self):
+        if not self.send_cached_page():
+            super().do_GET()
+
+    def do_HEAD(self):
+        if not self.send_cached_page(with_body=False):
+            super().do_HEAD()
+
+    def send_cached_page(self, with_body=True):
+        """
+        Отправляет страницу, если запрошена именно она.
+        """
+        if urlsplit(self.path).path not in self.page_urls:
+            return False
+
+        accepts_gzip = is_gzip_accepted(
+            self.headers.get('Accept-Encoding', '')
+        )
+        body = self.gzipped_page if accepts_gzip else self.page
+
+        self.send_response(HTTPStatus.OK)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        if accepts_gzip:
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Vary', 'Accept-Encoding')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+
+        if with_body:
+            self.wfile.write(body)
+        return True
+
+
+def create_page_handler(output_path):
+    """
+    Готовит обработчик запросов со страницей, прочитанной
+    и сжатой один раз при запуске.
+    """
+    page_path = Path(output_path).resolve()
+    page = page_path.read_bytes()
+
+    page_urls = {'/'}
+    if page_path.is_relative_to(Path.cwd()):
+        page_urls.add('/' + page_path.relative_to(Path.cwd()).as_posix())
+
+    return partial(
+        CachedPageHandler,
+        page_urls=page_urls,
+        page=page,
+        gzipped_page=gzip.compress(page)
+    )
 
 
 def parse_arguments():
@@ -153,6 +498,11 @@ def parse_arguments():
         default='wine_data.json',
         help='Путь для сохранения JSON файла'
     )
+    parser.add_argument(
+        '--compile-template',
+        action='store_true',
+        help=f'Скомпилировать {TEMPLATE_PATH} в Python-модуль и выйти'
+    )
 
     return parser.parse_args()
 
@@ -163,10 +513,22 @@ def main():
     """
     args = parse_arguments()
 
-    current_year = datetime.now().year
-    winery_age = current_year - FOUNDATION_YEAR
+    if args.compile_template:
+        module_path = compile_template()
+        print(f"Шаблон скомпилирован: {module_path}")
+        return
+
+    # Чтение Excel и компиляция шаблона не зависят друг от друга,
+    # поэтому выполняются параллельно
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        wines_future = executor.submit(
+            load_wine_data_from_excel,
+            args.excel_file
+        )
+        template_future = executor.submit(_get_template, TEMPLATE_PATH)
+        wines_list = wines_future.result()
+        template_future.result()
 
-    wines_list = load_wine_data_from_excel(args.excel_file)
     cheapest_wine = find_cheapest_wine(wines_list)
     grouped_wines = group_wines_by_category(
         wines_list,
@@ -176,12 +538,13 @@ def main():
     if args.save_json:
         save_data_to_json(grouped_wines, args.json_output)
 
-    generate_html_page(grouped_wines, winery_age, args.html_output)
+    generate_html_page(grouped_wines, WINERY_AGE, args.html_output)
 
     print(f"HTML файл создан: {args.html_output}")
     print("Запуск веб-сервера на http://127.0.0.1:8000")
 
-    server = HTTPServer(('127.0.0.1', 8000), SimpleHTTPRequestHandler)
+    handler = create_page_handler(args.html_output)
+    server = ThreadingHTTPServer(('127.0.0.1', 8000), handler)
     server.serve_forever()
 
 